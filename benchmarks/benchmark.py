@@ -0,0 +1,347 @@
+# Benchmarks for the hot paths of scrapy_toolbox
+# Uses a temporary SQLite database and stub GitHub/SMTP/Git transports, so no network or MySQL is needed.
+#
+#   python benchmarks/benchmark.py --output results.json
+#   python benchmarks/benchmark.py --compare results.json
+
+import os
+import sys
+# Benchmark the checkout this script lives in, not an installed scrapy_toolbox
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from scrapy import Item, Field, Request
+from scrapy.http import HtmlResponse
+from sqlalchemy import Column, Integer, String, Text
+from twisted.python.failure import Failure
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+from datetime import datetime
+import scrapy_toolbox.database as db
+import scrapy_toolbox.error_handling as error_handling
+from scrapy_toolbox.error_processing import ErrorProcessingMiddleware
+from scrapy_toolbox.mapper import ItemsModelMapper
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import json
+import re
+import io
+try:
+    from importlib.metadata import version
+except ImportError: # Python < 3.8
+    version = None
+
+# Upper bound for the response bytes stored per repeat of store_error_in_database, larger bodies get fewer iterations
+BODY_BYTES_PER_RUN = 10 * 1024 * 1024
+
+# Models and items, mapped by ItemsModelMapper via the XY / XYItem naming convention
+class Car(db.DeclarativeBase):
+    __tablename__ = "bench_cars"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255))
+    description = Column(Text)
+
+class CarItem(Item):
+    id = Field()
+    name = Field()
+    description = Field()
+
+models = SimpleNamespace(Car=Car)
+items = SimpleNamespace(CarItem=CarItem)
+
+# Stub transports for create_github_issue and send_mail
+class StubIssue:
+    number = 1
+    body = ""
+
+    def edit(self, body):
+        self.body = body
+
+class StubRepository:
+    def get_issues(self, state):
+        return []
+
+    def get_label(self, name):
+        return name
+
+    def create_issue(self, title, body, labels):
+        return StubIssue()
+
+class StubGithub:
+    def __init__(self, token):
+        pass
+
+    def get_repo(self, name):
+        return StubRepository()
+
+class StubSMTP:
+    def __init__(self, host):
+        pass
+
+    def send_message(self, msg):
+        pass
+
+    def quit(self):
+        pass
+
+class StubGitRepo:
+    working_tree_dir = "benchmark"
+
+    def __init__(self, path, search_parent_directories=False):
+        pass
+
+def stub_transports():
+    error_handling.Github = StubGithub
+    error_handling.SMTP = StubSMTP
+    error_handling.Repo = StubGitRepo
+    error_handling.settings.set("CREATE_GITHUB_ISSUE", True)
+    error_handling.settings.set("SEND_MAILS", True)
+    error_handling.settings.set("GITHUB_REPO", "benchmark/benchmark")
+    sys.argv = sys.argv[:1] + ["benchmark"] # create_github_issue and send_mail use sys.argv[1] as the spider name
+
+class BenchmarkPipeline(db.DatabasePipeline):
+    pass
+
+def new_pipeline(directory, name):
+    # DatabasePipeline is a Singleton, drop the cached instance so every benchmark gets its own pipeline and engine
+    BenchmarkPipeline.__it__ = None
+    database = {"drivername": "sqlite", "database": os.path.join(directory, f"{name}.sqlite")}
+    return BenchmarkPipeline(None, items=items, model=models, database=database, database_dev=database)
+
+def close_pipeline(pipeline):
+    pipeline.session.close()
+    pipeline.session.get_bind().dispose()
+
+def measure(name, params, iterations, repeat, setup, func):
+    # setup() is not timed and returns the argument passed to func()
+    seconds = []
+    for _ in range(repeat):
+        arg = setup()
+        with redirect_stdout(io.StringIO()): # store_error_in_database and the middlewares print a lot
+            start = time.perf_counter()
+            func(arg)
+            seconds.append(time.perf_counter() - start)
+    best = min(seconds)
+    return {
+        "name": name,
+        "params": params,
+        "iterations": iterations,
+        "seconds": seconds,
+        "best": best,
+        "median": statistics.median(seconds),
+        "ops_per_sec": iterations / best if best else None,
+    }
+
+def bench_process_item(directory, n, repeat):
+    results = []
+    for with_primary_keys in (False, True):
+        pipeline = new_pipeline(directory, f"process_item_{with_primary_keys}")
+        spider = SimpleNamespace(name="benchmark")
+        offset = [0]
+
+        def setup():
+            start = offset[0]
+            offset[0] += n
+            if with_primary_keys:
+                return [CarItem(id=start + i + 1, name=f"car {i}", description="x" * 200) for i in range(n)]
+            return [CarItem(name=f"car {i}", description="x" * 200) for i in range(n)]
+
+        def run(batch):
+            for item in batch:
+                pipeline.process_item(item, spider)
+
+        results.append(measure("DatabasePipeline.process_item", {"with_primary_keys": with_primary_keys}, n, repeat, setup, run))
+        close_pipeline(pipeline)
+    return results
+
+def bench_map_to_model(directory, n, repeat):
+    results = []
+    pipeline = new_pipeline(directory, "map_to_model")
+    session = pipeline.session
+    session.add_all([Car(id=i + 1, name=f"car {i}") for i in range(n)])
+    session.commit()
+    mapper = ItemsModelMapper(items=items, model=models)
+    for with_primary_keys in (False, True):
+        def setup():
+            if with_primary_keys:
+                return [CarItem(id=i + 1, name=f"car {i}") for i in range(n)]
+            return [CarItem(name=f"car {i}") for i in range(n)]
+
+        def run(batch):
+            for item in batch:
+                mapper.map_to_model(item=item, sess=session)
+
+        results.append(measure("ItemsModelMapper.map_to_model", {"with_primary_keys": with_primary_keys}, n, repeat, setup, run))
+    close_pipeline(pipeline)
+    return results
+
+def make_failure():
+    try:
+        raise ValueError("benchmark")
+    except ValueError:
+        return Failure()
+
+def make_request(i):
+    return Request(
+        url=f"https://example.com/page/{i}",
+        method="POST",
+        meta={"download_latency": 0.5, "depth": 1, "page": i},
+        cookies={"session": "0123456789abcdef"},
+        headers={"User-Agent": "scrapy-toolbox-benchmark", "Accept": "text/html"},
+        body=f"page={i}",
+    )
+
+def bench_store_error(directory, n, repeat, body_sizes):
+    results = []
+    pipeline = new_pipeline(directory, "store_error")
+    spider = SimpleNamespace(name="benchmark", crawler=SimpleNamespace(database_session=pipeline.session))
+    failure = make_failure()
+    for size in body_sizes:
+        body = (b"<html><body>" + b"x" * size + b"</body></html>")[:size]
+        iterations = max(1, min(n, BODY_BYTES_PER_RUN // size))
+
+        def setup():
+            pairs = []
+            for i in range(iterations):
+                request = make_request(i)
+                response = HtmlResponse(url=request.url, status=500, headers={"Content-Type": "text/html"}, body=body, request=request)
+                pairs.append((request, response))
+            return pairs
+
+        def run(pairs):
+            for request, response in pairs:
+                error_handling.ErrorSaving.store_error_in_database(failure, spider, request, response)
+
+        results.append(measure("ErrorSaving.store_error_in_database", {"response_body_bytes": size}, iterations, repeat, setup, run))
+    close_pipeline(pipeline)
+    return results
+
+def bench_replay(directory, backlogs, repeat):
+    results = []
+    pipeline = new_pipeline(directory, "replay")
+    session = pipeline.session
+    spider = SimpleNamespace(name="benchmark", process_errors=True, crawler=SimpleNamespace(database_session=session))
+    middleware = ErrorProcessingMiddleware()
+    for n in backlogs:
+        def setup():
+            session.query(error_handling.Error).delete(synchronize_session=False)
+            session.bulk_save_objects([error_handling.Error(
+                failed_at=datetime.now(),
+                spider=spider.name,
+                url=f"https://example.com/page/{i}",
+                request_method="GET",
+                request_url=f"https://example.com/page/{i}",
+                request_meta=json.dumps({"download_latency": 0.5, "depth": 1}),
+                request_cookies=json.dumps({}),
+                request_headers=json.dumps({"Accept": "text/html"}),
+                request_body="",
+                response_body="x" * 10000,
+            ) for i in range(n)])
+            session.commit()
+
+        def run(_):
+            for _ in middleware.process_start_requests([], spider):
+                pass
+
+        results.append(measure("ErrorProcessingMiddleware.process_start_requests", {"backlog": n}, n, repeat, setup, run))
+    close_pipeline(pipeline)
+    return results
+
+def bench_catch_exception(n, repeat):
+    results = []
+
+    class Target:
+        def value(self):
+            return 1
+
+        def generator(self):
+            yield 1
+
+        def failing(self):
+            raise ValueError("benchmark")
+
+    def call_value(method, target):
+        for _ in range(n):
+            method(target)
+
+    def call_generator(method, target):
+        for _ in range(n):
+            for _ in method(target):
+                pass
+
+    def call_failing(method, target):
+        for _ in range(n):
+            try:
+                method(target)
+            except ValueError:
+                pass
+
+    for kind, method, call in (("value", Target.value, call_value), ("generator", Target.generator, call_generator), ("exception", Target.failing, call_failing)):
+        for wrapped in (False, True):
+            func = error_handling.catch_exception(method) if wrapped else method
+            results.append(measure("catch_exception", {"kind": kind, "wrapped": wrapped}, n, repeat, Target, lambda target: call(func, target)))
+    return results
+
+def versions():
+    result = {"python": platform.python_version(), "platform": platform.platform()}
+    for package in ("scrapy", "sqlalchemy"):
+        try:
+            result[package] = version(package)
+        except Exception:
+            result[package] = None
+    # The measured code is the checkout, so record its setup.py version and git revision
+    with open(os.path.join(ROOT, "setup.py")) as f:
+        match = re.search(r'version="([^"]+)"', f.read())
+    result["scrapy-toolbox"] = match.group(1) if match else None
+    try:
+        result["git_revision"] = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        result["git_revision"] = None
+    return result
+
+def key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in json.load(f)["results"]}
+    for result in results:
+        old = baseline.get(key(result))
+        if old and old["ops_per_sec"] and result["ops_per_sec"]:
+            ratio = result["ops_per_sec"] / old["ops_per_sec"]
+            print(f"{result['name']} {json.dumps(result['params'], sort_keys=True)}: {old['ops_per_sec']:.1f} -> {result['ops_per_sec']:.1f} ops/s ({ratio:.2f}x)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of scrapy_toolbox")
+    parser.add_argument("--output", help="write the json results to this file instead of stdout")
+    parser.add_argument("--compare", help="json results of an earlier run to compare against")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--backlogs", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("--body-sizes", type=int, nargs="+", default=[1024, 100 * 1024, 1024 * 1024])
+    args = parser.parse_args()
+
+    stub_transports()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        results += bench_process_item(directory, args.items, args.repeat)
+        results += bench_map_to_model(directory, args.items, args.repeat)
+        results += bench_store_error(directory, max(args.items // 10, 1), args.repeat, args.body_sizes)
+        results += bench_replay(directory, args.backlogs, args.repeat)
+    results += bench_catch_exception(args.items * 10, args.repeat)
+
+    output = json.dumps({"created_at": datetime.now().isoformat(), "versions": versions(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
 import subprocess
 import sys
 
+def purge_errors(spider=None):
+    from scrapy.utils.project import get_project_settings
+    from .database import DatabasePipeline
+    from .error_maintenance import ErrorMaintenance
+    settings = get_project_settings()
+    session = DatabasePipeline(settings).session
+    stats = ErrorMaintenance(session, settings).run(spider)
+    print(stats)
+
 def main():
     arg1 = sys.argv[1]
-    if arg1:
+    if arg1 == "purge-errors":
+        purge_errors(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif arg1:
         subprocess.check_output(["scrapy", "crawl", arg1, "-a process_errors=True"])
 
 if __name__ == "__main__":
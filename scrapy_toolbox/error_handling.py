@@ -1,5 +1,5 @@
 from scrapy import signals
-from sqlalchemy import Column, Integer, DateTime, Text, String
+from sqlalchemy import Column, Integer, DateTime, Text, String, Index
 from .database import DeclarativeBase
 from datetime import datetime
 import json
@@ -57,6 +57,7 @@ class ErrorSaving():
 
 class Error(DeclarativeBase):
     __tablename__ = "__errors"
+    __table_args__ = (Index("ix___errors_spider_failed_at", "spider", "failed_at"),)
 
     id = Column(Integer, primary_key=True)
     failed_at = Column(DateTime)
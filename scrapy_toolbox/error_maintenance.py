@@ -0,0 +1,181 @@
+from scrapy import signals
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.log import failure_to_exc_info
+from twisted.internet import task
+from sqlalchemy import inspect, and_, or_
+from .error_handling import Error
+from datetime import datetime, timedelta
+from os import path as ospath
+import gzip
+import json
+import os
+
+class ErrorMaintenance:
+    # Keeps the "__errors" table small:
+    # - retention: rows older than ERRORS_RETENTION_DAYS and rows beyond the newest ERRORS_RETENTION_MAX_ROWS per spider are purged
+    # - compaction: response bodies of rows older than ERRORS_COMPACT_AFTER_DAYS are emptied (they are not needed for request reconstruction)
+    # - archival: purged rows are written to gzipped json lines files in ERRORS_ARCHIVE_DIR before they are deleted
+    #   (rows compacted before they are purged are archived without their response body)
+    # Deletes and updates run in chunks of ERRORS_MAINTENANCE_CHUNK_SIZE rows, each in its own transaction, to keep locks short.
+    # All chunks are walked in (failed_at, id) order, which the (spider, failed_at) index supplies without sorting.
+
+    def __init__(self, session, settings=None):
+        settings = settings if settings is not None else get_project_settings()
+        self.session = session
+        self.retention_days = settings.getint("ERRORS_RETENTION_DAYS", 0)
+        self.max_rows = settings.getint("ERRORS_RETENTION_MAX_ROWS", 0)
+        self.compact_after_days = settings.getint("ERRORS_COMPACT_AFTER_DAYS", 0)
+        self.chunk_size = settings.getint("ERRORS_MAINTENANCE_CHUNK_SIZE", 500)
+        self.archive_dir = settings.get("ERRORS_ARCHIVE_DIR")
+        self.stats = {"purged_by_age": 0, "purged_by_count": 0, "compacted": 0}
+
+    def run(self, spider=None):
+        for _ in self.steps(spider):
+            pass
+        return self.stats
+
+    def steps(self, spider=None):
+        # Yields after every chunk, so it can be driven by twisted's task.cooperate without blocking the reactor
+        try:
+            self.ensure_index()
+            spiders = [spider] if spider else [s for (s,) in self.session.query(Error.spider).distinct()]
+            for name in spiders:
+                if self.retention_days:
+                    cutoff = datetime.now() - timedelta(days=self.retention_days)
+                    yield from self.purge(name, "purged_by_age", Error.failed_at < cutoff)
+                if self.max_rows:
+                    oldest_kept = self.session.query(Error.failed_at, Error.id).filter(Error.spider == name) \
+                        .order_by(Error.failed_at.desc(), Error.id.desc()).offset(self.max_rows - 1).limit(1).first()
+                    if oldest_kept is not None:
+                        yield from self.purge(name, "purged_by_count", self.before(*oldest_kept))
+                if self.compact_after_days:
+                    cutoff = datetime.now() - timedelta(days=self.compact_after_days)
+                    yield from self.compact(name, cutoff)
+        finally:
+            self.session.close()
+
+    def ensure_index(self):
+        # create_all does not add indexes to an already existing "__errors" table
+        bind = self.session.get_bind()
+        existing = {index["name"] for index in inspect(bind).get_indexes(Error.__tablename__)}
+        for index in Error.__table__.indexes:
+            if index.name not in existing:
+                index.create(bind)
+
+    def before(self, failed_at, id):
+        return or_(Error.failed_at < failed_at, and_(Error.failed_at == failed_at, Error.id < id))
+
+    def after(self, failed_at, id):
+        return or_(Error.failed_at > failed_at, and_(Error.failed_at == failed_at, Error.id > id))
+
+    def purge(self, spider, stat, condition):
+        archive = self.open_archive(spider) if self.archive_dir else None
+        purged = 0
+        try:
+            while True:
+                # Purged rows are gone, so every chunk starts at the beginning of the index range again
+                rows = self.session.query(Error if archive else Error.id) \
+                    .filter(Error.spider == spider, condition) \
+                    .order_by(Error.failed_at, Error.id).limit(self.chunk_size).all()
+                if not rows:
+                    break
+                if archive:
+                    for row in rows:
+                        archive.write(json.dumps(self.serialize(row)) + "\n")
+                    archive.flush()
+                ids = [row.id for row in rows]
+                try:
+                    self.session.query(Error).filter(Error.id.in_(ids)).delete(synchronize_session=False)
+                    self.session.commit()
+                except:
+                    self.session.rollback()
+                    raise
+                self.session.expunge_all()
+                purged += len(ids)
+                self.stats[stat] += len(ids)
+                yield
+        finally:
+            if archive:
+                archive.close()
+                if not purged:
+                    os.remove(archive.name)
+
+    def compact(self, spider, cutoff):
+        last = None
+        while True:
+            query = self.session.query(Error.failed_at, Error.id) \
+                .filter(Error.spider == spider, Error.failed_at < cutoff)
+            if last:
+                query = query.filter(self.after(*last))
+            rows = query.order_by(Error.failed_at, Error.id).limit(self.chunk_size).all()
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            try:
+                compacted = self.session.query(Error).filter(Error.id.in_(ids), Error.response_body != "") \
+                    .update({Error.response_body: ""}, synchronize_session=False)
+                self.session.commit()
+            except:
+                self.session.rollback()
+                raise
+            self.stats["compacted"] += compacted
+            last = tuple(rows[-1])
+            yield
+
+    def open_archive(self, spider):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        filename = f"__errors-{spider}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jsonl.gz"
+        return gzip.open(ospath.join(self.archive_dir, filename), "wt", encoding="utf-8")
+
+    def serialize(self, error):
+        row = {}
+        for column in Error.__table__.columns:
+            value = getattr(error, column.name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, bytes):
+                value = value.decode("utf-8", errors="replace")
+            row[column.name] = value
+        return row
+
+class ErrorMaintenanceMiddleware:
+    # Runs ErrorMaintenance every ERRORS_MAINTENANCE_INTERVAL seconds while the spider is open (disabled when 0).
+    # Each run is spread over the reactor chunk by chunk; failures are logged and the next run is still scheduled.
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.interval = crawler.settings.getint("ERRORS_MAINTENANCE_INTERVAL", 0)
+        self.loop = None
+        self.task = None
+
+    def spider_opened(self, spider):
+        if self.interval and not hasattr(spider, "process_errors"):
+            self.loop = task.LoopingCall(self.run, spider)
+            self.loop.start(self.interval, now=True)
+
+    def run(self, spider):
+        maintenance = ErrorMaintenance(self.crawler.database_session, self.crawler.settings)
+        self.task = task.cooperate(maintenance.steps(spider.name))
+        d = self.task.whenDone()
+        d.addCallback(lambda _: spider.logger.info(f"__errors maintenance: {maintenance.stats}"))
+        d.addErrback(self.run_failed, spider)
+        return d
+
+    def run_failed(self, failure, spider):
+        if not failure.check(task.TaskStopped):
+            spider.logger.error("__errors maintenance failed", exc_info=failure_to_exc_info(failure))
+
+    def spider_closed(self, spider, reason):
+        if self.task:
+            try:
+                self.task.stop()
+            except task.TaskFinished:
+                pass
+        if self.loop and self.loop.running:
+            self.loop.stop()